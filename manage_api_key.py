@@ -1,36 +1,107 @@
 #!/usr/bin/env python3
 import os
+import stat
 import sys
 from pathlib import Path
 
+def parse_env_line(line):
+    """Split a .env line into (key, value) the way python-dotenv does.
+    
+    Returns None for blank lines, comments and lines without "=".
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if line[:7] in ("export ", "export\t"):
+        line = line[7:].lstrip()
+    key, sep, value = line.partition("=")
+    if not sep:
+        return None
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+        value = value[1:-1]
+    return key.strip(), value
+
+def is_api_key_line(line):
+    """Check whether a .env line assigns GROQ_API_KEY."""
+    entry = parse_env_line(line)
+    return entry is not None and entry[0] == "GROQ_API_KEY"
+
+# Optional: Parse .env with python-dotenv
+try:
+    from dotenv import dotenv_values
+except ImportError:
+    # python-dotenv not installed, fall back to the same line parser
+    # used when updating .env
+    def dotenv_values(path):
+        values = {}
+        for line in Path(path).read_text(encoding="utf-8").splitlines():
+            entry = parse_env_line(line)
+            if entry is not None:
+                values[entry[0]] = entry[1]
+        return values
+
+def _mask(key):
+    """Mask the key for security, keeping the first and last 4 characters."""
+    if len(key) > 8:
+        return key[:4] + "*" * (len(key) - 8) + key[-4:]
+    return "*" * len(key)
+
 def view_api_key():
     """View current API key from .env or environment."""
     # Try .env file first
     env_file = Path(".env")
     if env_file.exists():
-        with open(env_file) as f:
-            for line in f:
-                if line.startswith("GROQ_API_KEY="):
-                    key = line.strip().split("=", 1)[1]
-                    # Mask the key for security
-                    if len(key) > 8:
-                        masked = key[:4] + "*" * (len(key) - 8) + key[-4:]
-                    else:
-                        masked = "*" * len(key)
-                    print(f"Current API key (.env): {masked}")
-                    return
+        key = dotenv_values(env_file).get("GROQ_API_KEY")
+        if key:
+            print(f"Current API key (.env): {_mask(key)}")
+            return
     
     # Check environment variable
     env_key = os.environ.get("GROQ_API_KEY")
     if env_key:
-        if len(env_key) > 8:
-            masked = env_key[:4] + "*" * (len(env_key) - 8) + env_key[-4:]
-        else:
-            masked = "*" * len(env_key)
-        print(f"Current API key (environment): {masked}")
+        print(f"Current API key (environment): {_mask(env_key)}")
     else:
         print("No API key found!")
 
+def read_other_vars(env_file):
+    """Read .env and return (key_found, other non-empty lines)."""
+    found = False
+    other_vars = []
+    for line in env_file.read_text(encoding="utf-8").splitlines():
+        if is_api_key_line(line):
+            found = True
+        elif line.strip():
+            other_vars.append(line.rstrip())
+    return found, other_vars
+
+def write_env_file(env_file, lines):
+    """Atomically replace .env with the given lines."""
+    # Assemble the whole file in one buffer so it is written with one call
+    buf = bytearray()
+    for line in lines:
+        buf.extend(line.encode("utf-8"))
+        buf.append(0x0A)
+    
+    # Keep the permissions of the existing .env (the key is a secret), or
+    # make a new one readable by the owner only
+    mode = stat.S_IMODE(env_file.stat().st_mode) if env_file.exists() else 0o600
+    
+    tmp_file = env_file.with_name(env_file.name + ".tmp")
+    try:
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with open(fd, 'wb') as f:
+            f.write(buf)
+            f.flush()
+            os.fsync(f.fileno())
+        # os.open applies the umask and keeps the mode of a stale temp file
+        os.chmod(tmp_file, mode)
+        os.replace(tmp_file, env_file)
+    finally:
+        # Do not leave a copy of the key behind if anything failed
+        if tmp_file.exists():
+            tmp_file.unlink()
+
 def set_api_key(new_key):
     """Set new API key in .env file."""
     env_file = Path(".env")
@@ -38,17 +109,10 @@ def set_api_key(new_key):
     # Read existing content
     other_vars = []
     if env_file.exists():
-        with open(env_file) as f:
-            for line in f:
-                if not line.startswith("GROQ_API_KEY="):
-                    other_vars.append(line.rstrip())
+        _, other_vars = read_other_vars(env_file)
     
     # Write new content
-    with open(env_file, 'w') as f:
-        f.write(f"GROQ_API_KEY={new_key}\n")
-        for var in other_vars:
-            if var.strip():  # Only write non-empty lines
-                f.write(f"{var}\n")
+    write_env_file(env_file, [f"GROQ_API_KEY={new_key}"] + other_vars)
     
     print(f"✅ API key updated in .env file")
 
@@ -61,21 +125,11 @@ def remove_api_key():
         return
     
     # Read and filter content
-    other_vars = []
-    found = False
-    with open(env_file) as f:
-        for line in f:
-            if line.startswith("GROQ_API_KEY="):
-                found = True
-            else:
-                other_vars.append(line.rstrip())
+    found, other_vars = read_other_vars(env_file)
     
     if found:
         # Write back without API key
-        with open(env_file, 'w') as f:
-            for var in other_vars:
-                if var.strip():
-                    f.write(f"{var}\n")
+        write_env_file(env_file, other_vars)
         print("✅ API key removed from .env file")
     else:
         print("No API key found in .env file!")
@@ -1,9 +1,26 @@
-from groq import Groq
-import base64
+from groq import Groq, AsyncGroq
+import orjson
+import asyncio
+import io
+import mmap
 import os
-import json
-import glob
-from typing import Dict, Any, Optional
+import tempfile
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+# Optional: Use the SIMD-accelerated base64 codec when available
+try:
+    import pybase64 as base64
+except ImportError:
+    # pybase64 not installed, fall back to the standard library codec
+    import base64
+
+# Optional: Downscale images with Pillow before sending them to the model
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    # Pillow not installed, send images at their original resolution
+    Image = None
 
 # Optional: Load environment variables from .env file
 try:
@@ -13,119 +30,218 @@ except ImportError:
     # python-dotenv not installed, skip .env file loading
     pass
 
-# Function to encode the image
-def encode_image(image_path: str) -> str:
-    """Encode image file to base64 string."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+# Process umask, read once at import (os.umask can only be read by setting it)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
-def create_extraction_prompt(system_prompt: str, json_schema: Dict[str, Any]) -> str:
-    """Create the full extraction prompt with system instructions and schema."""
-    prompt = f"""{system_prompt}
+# Supported image file extensions (matched case-insensitively)
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp'}
 
-Please extract the information according to this JSON schema:
-{json.dumps(json_schema, indent=2)}
+# Maximum number of in-flight API requests during batch processing.
+# Keep this below the Groq rate limit to avoid 429 responses.
+MAX_CONCURRENT_REQUESTS = 8
 
-Return ONLY valid JSON that matches this schema. Do not include any explanatory text."""
-    return prompt
+# Read size for streaming base64 encoding; a multiple of 3 so that
+# chunks encode without padding and can be concatenated directly.
+# Large enough for the SIMD codec to amortize its per-call overhead.
+ENCODE_CHUNK_SIZE = 3 * 16 * 1024
+
+# Data URL prefix, kept as bytes so the URL is assembled without str copies.
+_DATA_URL_PREFIX = b"data:image/jpeg;base64,"
+
+# Image budget for the vision model. Receipts stay legible at this size,
+# while larger images only add tokens, latency and cost.
+MAX_IMAGE_DIMENSION = 1536
+JPEG_QUALITY = 85
+
+def preprocess_image(image_path: str) -> Optional[io.BytesIO]:
+    """Downscale and recompress an image to a JPEG within the image budget.
+    
+    Returns None when the original file should be sent as is: Pillow is
+    not installed, Pillow cannot read the file (e.g. it is empty), or the
+    image is already a JPEG within the budget.
+    """
+    if Image is None:
+        return None
+    
+    try:
+        img = Image.open(image_path)
+    except OSError:
+        return None
+    
+    with img:
+        if img.format == "JPEG" and max(img.size) <= MAX_IMAGE_DIMENSION:
+            return None
+        
+        # Apply EXIF rotation, since the metadata is dropped on re-save
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.convert("RGB").save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    
+    return buffer
 
-def extract_receipt_data(image_path: str, api_key: Optional[str] = None) -> Dict[str, Any]:
-    """Extract receipt data from an image using Groq API."""
+def encode_data_url(data: memoryview) -> bytearray:
+    """Encode image bytes to a base64 data URL in a single pre-sized buffer."""
+    data_url = bytearray(len(_DATA_URL_PREFIX) + 4 * ((len(data) + 2) // 3))
+    data_url[:len(_DATA_URL_PREFIX)] = _DATA_URL_PREFIX
     
-    # Initialize Groq client
-    client = Groq(api_key=api_key or os.environ.get("GROQ_API_KEY"))
+    # Encode fixed-size slices straight into the output buffer
+    position = len(_DATA_URL_PREFIX)
+    for offset in range(0, len(data), ENCODE_CHUNK_SIZE):
+        encoded = base64.b64encode(data[offset:offset + ENCODE_CHUNK_SIZE])
+        data_url[position:position + len(encoded)] = encoded
+        position += len(encoded)
     
-    # System prompt
-    system_prompt = """Extract the following details from the provided image of receipt document. First look for VAT identification number (vatNumber) in the document and associated name of the company (companyName).
+    return data_url
+
+# Function to encode the image
+def encode_image(image_path: str) -> bytearray:
+    """Encode image file to a base64 data URL, downscaling it first if needed."""
+    preprocessed = preprocess_image(image_path)
+    if preprocessed is not None:
+        with preprocessed.getbuffer() as view:
+            return encode_data_url(view)
+    
+    fd = os.open(image_path, os.O_RDONLY)
+    try:
+        if not os.fstat(fd).st_size:
+            # Empty files cannot be memory-mapped
+            return encode_data_url(memoryview(b""))
+        
+        # Map the file instead of reading it into a bytes copy
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            return encode_data_url(view)
+    finally:
+        os.close(fd)
+
+# System prompt
+SYSTEM_PROMPT = """Extract the following details from the provided image of receipt document. First look for VAT identification number (vatNumber) in the document and associated name of the company (companyName).
 Ensure all fields from the schema are populated if the information is present in the document. If a piece of information is not found, you may omit the field or use a suitable placeholder like 'N/A' if the schema requires it, but prioritize extracting actual values. For numerical values (prices, VAT amount, VAT rate), provide them as numbers (float).
 For VAT rate, if it's written as e.g. '21%', provide the number 21. Also, extract the date of sale (transaction date) from the receipt always in dd.mm.yyyy format. It might be in dd/mm/yyyy or dd.mm.yyyy format on document. If multiple dates are present (e.g., issue date, due date), use the primary transaction sale date."""
 
-    # JSON schema
-    json_schema = {
-        "type": "object",
-        "required": ["companyName", "vatNumber", "priceWithoutVAT", "vat", "vatRate", "priceIncludingVAT", "dateOfSale"],
-        "properties": {
-            "companyName": {
-                "type": "string",
-                "description": "The legal name of the company that issued the receipt always associated with the VAT identification number. Legal name always includes legal form (e.g. s.r.o., a.s. etc.)"
-            },
-            "vatNumber": {
-                "type": "string",
-                "description": "The VAT identification number of the company."
-            },
-            "priceWithoutVAT": {
-                "type": "number",
-                "format": "float",
-                "description": "The total price of goods/services before VAT is applied. Use 0.0 if not explicitly found."
-            },
-            "vat": {
-                "type": "number",
-                "format": "float",
-                "description": "The total VAT amount charged. Use 0.0 if not explicitly found."
-            },
-            "vatRate": {
-                "type": "number",
-                "format": "float",
-                "description": "The VAT rate as a percentage (e.g., 21 for 21%). Use 0.0 if not explicitly found."
-            },
-            "priceIncludingVAT": {
-                "type": "number",
-                "format": "float",
-                "description": "The final price including VAT. This is usually the most prominent total amount."
-            },
-            "dateOfSale": {
-                "type": "string",
-                "description": "The date of sale or transaction date from the receipt, in dd.mm.yyyy format."
-            }
-        }
+# Serialized JSON schema text, kept as a string since it is only ever embedded in the prompt
+JSON_SCHEMA_TEXT = """{
+  "type": "object",
+  "required": [
+    "companyName",
+    "vatNumber",
+    "priceWithoutVAT",
+    "vat",
+    "vatRate",
+    "priceIncludingVAT",
+    "dateOfSale"
+  ],
+  "properties": {
+    "companyName": {
+      "type": "string",
+      "description": "The legal name of the company that issued the receipt always associated with the VAT identification number. Legal name always includes legal form (e.g. s.r.o., a.s. etc.)"
+    },
+    "vatNumber": {
+      "type": "string",
+      "description": "The VAT identification number of the company."
+    },
+    "priceWithoutVAT": {
+      "type": "number",
+      "format": "float",
+      "description": "The total price of goods/services before VAT is applied. Use 0.0 if not explicitly found."
+    },
+    "vat": {
+      "type": "number",
+      "format": "float",
+      "description": "The total VAT amount charged. Use 0.0 if not explicitly found."
+    },
+    "vatRate": {
+      "type": "number",
+      "format": "float",
+      "description": "The VAT rate as a percentage (e.g., 21 for 21%). Use 0.0 if not explicitly found."
+    },
+    "priceIncludingVAT": {
+      "type": "number",
+      "format": "float",
+      "description": "The final price including VAT. This is usually the most prominent total amount."
+    },
+    "dateOfSale": {
+      "type": "string",
+      "description": "The date of sale or transaction date from the receipt, in dd.mm.yyyy format."
     }
+  }
+}"""
+
+# Full extraction prompt, reused for every image
+EXTRACTION_PROMPT = f"""{SYSTEM_PROMPT}
+
+Please extract the information according to this JSON schema:
+{JSON_SCHEMA_TEXT}
+
+Return ONLY valid JSON that matches this schema. Do not include any explanatory text."""
+
+# Chat completion options shared by the sync and async extractors
+COMPLETION_OPTIONS = {
+    "model": "meta-llama/llama-4-maverick-17b-128e-instruct",
+    "temperature": 0.2,  # Lower temperature for more consistent extraction
+    "max_tokens": 1000,
+    "response_format": {"type": "json_object"},  # JSON mode guarantees parseable output
+}
+
+def build_messages(image_path: str) -> List[Dict[str, Any]]:
+    """Build the chat messages (prompt + encoded image) for a receipt."""
     
     # Encode the image
-    base64_image = encode_image(image_path)
+    image_data_url = encode_image(image_path)
     
-    # Create the full prompt
-    extraction_prompt = create_extraction_prompt(system_prompt, json_schema)
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": EXTRACTION_PROMPT},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        # The SDK serializes the request as JSON, so the URL
+                        # is decoded to str only here, once
+                        "url": image_data_url.decode('ascii'),
+                    },
+                },
+            ],
+        }
+    ]
+
+def extract_receipt_data(client: Groq, image_path: str) -> Dict[str, Any]:
+    """Extract receipt data from an image using a shared Groq client."""
     
     try:
         # Make API call
         chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": extraction_prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                            },
-                        },
-                    ],
-                }
-            ],
-            model="meta-llama/llama-4-maverick-17b-128e-instruct",
-            temperature=0.2,  # Lower temperature for more consistent extraction
-            max_tokens=1000
+            messages=build_messages(image_path),
+            **COMPLETION_OPTIONS
         )
         
-        # Get the response
-        response_content = chat_completion.choices[0].message.content
+        # Get the response and parse JSON from it
+        return orjson.loads(chat_completion.choices[0].message.content)
         
-        # Parse JSON from response
-        # Try to extract JSON from the response in case there's extra text
-        try:
-            # First try direct parsing
-            extracted_data = json.loads(response_content)
-        except json.JSONDecodeError:
-            # If that fails, try to find JSON in the response
-            import re
-            json_match = re.search(r'\{[\s\S]*\}', response_content)
-            if json_match:
-                extracted_data = json.loads(json_match.group())
-            else:
-                raise ValueError("Could not find valid JSON in the response")
+    except Exception as e:
+        print(f"Error processing {image_path}: {str(e)}")
+        return None
+
+async def extract_receipt_data_async(client: AsyncGroq, image_path: str,
+                                     executor: Optional[Executor] = None) -> Dict[str, Any]:
+    """Extract receipt data from an image using the async Groq client."""
+    
+    try:
+        # Read, resize and encode the image off the event loop so other
+        # requests keep being dispatched while this one is prepared
+        loop = asyncio.get_running_loop()
+        messages = await loop.run_in_executor(executor, build_messages, image_path)
         
-        return extracted_data
+        # Make API call
+        chat_completion = await client.chat.completions.create(
+            messages=messages,
+            **COMPLETION_OPTIONS
+        )
+        
+        # Get the response and parse JSON from it
+        return orjson.loads(chat_completion.choices[0].message.content)
         
     except Exception as e:
         print(f"Error processing {image_path}: {str(e)}")
@@ -138,49 +254,126 @@ def get_json_filename(image_path: str) -> str:
     # Create JSON filename with the same base name
     return f"{base_name}.json"
 
-def process_all_receipts(directory: str = ".") -> None:
-    """Process all image files in the specified directory."""
+def save_json(json_filename: str, data: Dict[str, Any]) -> bytes:
+    """Serialize extracted data once, write it to disk and return the bytes.
     
-    # Get all image files in the directory
-    image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.gif', '*.bmp']
-    image_files = []
+    The file is written to a temporary name and then renamed, so an
+    interrupted run never leaves a truncated result that would later be
+    skipped as already processed.
+    """
+    payload = orjson.dumps(data, option=orjson.OPT_INDENT_2)
     
-    for ext in image_extensions:
-        image_files.extend(glob.glob(os.path.join(directory, ext)))
-        image_files.extend(glob.glob(os.path.join(directory, ext.upper())))
+    # Use a unique temporary file per call: receipts with the same base
+    # name (e.g. receipt.jpg and receipt.png) are saved concurrently
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(json_filename) or ".",
+                                        prefix=os.path.basename(json_filename), suffix=".tmp")
+    try:
+        with open(fd, 'wb') as f:
+            f.write(payload)
+        # mkstemp creates the file owner-only; give results the usual mode
+        os.chmod(tmp_filename, 0o666 & ~_UMASK)
+        os.replace(tmp_filename, json_filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    return payload
+
+def is_already_processed(image_path: str) -> bool:
+    """Check whether the image has a JSON result at least as new as itself."""
+    json_filename = get_json_filename(image_path)
+    return (os.path.exists(json_filename)
+            and os.path.getmtime(json_filename) >= os.path.getmtime(image_path))
+
+def process_all_receipts(directory: str = ".", force: bool = False, quiet: bool = False) -> None:
+    """Process all image files in the specified directory.
+    
+    Images whose JSON result is already up to date are skipped unless
+    force is set. With quiet set, extracted data is only written to the
+    JSON files and not echoed to the console.
+    """
+    
+    # Get all image files in the directory in a single listing pass,
+    # skipping hidden files (e.g. macOS ._* metadata) like glob does
+    with os.scandir(directory) as entries:
+        image_files = sorted(
+            entry.path for entry in entries
+            if not entry.name.startswith('.') and entry.is_file()
+            and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+        )
     
     if not image_files:
         print(f"No image files found in {directory}")
         return
     
+    # Skip images extracted by a previous run
+    if not force:
+        pending_files = [image_path for image_path in image_files if not is_already_processed(image_path)]
+        skipped_count = len(image_files) - len(pending_files)
+        if skipped_count:
+            print(f"Skipping {skipped_count} already processed image(s) (use --force to re-process)")
+        image_files = pending_files
+        if not image_files:
+            print("All images are already processed")
+            return
+    
     print(f"Found {len(image_files)} image(s) to process")
     
-    # Process each image
+    # Process images concurrently, bounded by MAX_CONCURRENT_REQUESTS
+    results = asyncio.run(_process_receipts_async(image_files, quiet))
     successful_count = 0
-    for image_path in image_files:
-        print(f"\nProcessing: {os.path.basename(image_path)}")
-        
-        extracted_data = extract_receipt_data(image_path)
-        
-        if extracted_data:
-            # Generate JSON filename maintaining original naming
-            json_filename = get_json_filename(image_path)
-            
-            # Save individual result to JSON file
-            with open(json_filename, 'w', encoding='utf-8') as f:
-                json.dump(extracted_data, f, indent=2, ensure_ascii=False)
-            
-            print(f"✅ Successfully extracted data from {os.path.basename(image_path)}")
-            print(f"   Saved to: {json_filename}")
-            print(json.dumps(extracted_data, indent=2))
+    for image_path, result in zip(image_files, results):
+        if isinstance(result, BaseException):
+            # Unexpected errors are collected by gather; report them here
+            print(f"❌ Error processing {os.path.basename(image_path)}: {result!r}")
+        elif result is True:
             successful_count += 1
-        else:
-            print(f"❌ Failed to extract data from {os.path.basename(image_path)}")
     
     # Summary
     print(f"\n{'='*50}")
     print(f"Processing complete: {successful_count}/{len(image_files)} files processed successfully")
 
+async def _process_receipts_async(image_files: List[str], quiet: bool) -> List[Any]:
+    """Run extraction for all images concurrently with a single async client."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        async with AsyncGroq(api_key=os.environ["GROQ_API_KEY"]) as client:
+            tasks = [_process_receipt(client, semaphore, executor, image_path, quiet) for image_path in image_files]
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+async def _process_receipt(client: AsyncGroq, semaphore: asyncio.Semaphore,
+                           executor: Executor, image_path: str, quiet: bool) -> bool:
+    """Extract a single receipt and save the result; return True on success."""
+    async with semaphore:
+        print(f"\nProcessing: {os.path.basename(image_path)}")
+        extracted_data = await extract_receipt_data_async(client, image_path, executor)
+    
+    if extracted_data:
+        # Generate JSON filename maintaining original naming
+        json_filename = get_json_filename(image_path)
+        
+        # Save individual result to JSON file on the shared thread pool,
+        # so the event loop keeps dispatching requests during disk writes.
+        # Receipts sharing a base name can be saved at the same time;
+        # save_json writes each to its own temp file and renames it, so
+        # the writes never interleave and the last one wins.
+        loop = asyncio.get_running_loop()
+        try:
+            payload = await loop.run_in_executor(executor, save_json, json_filename, extracted_data)
+        except OSError as e:
+            print(f"Error saving {json_filename}: {str(e)}")
+            print(f"❌ Failed to extract data from {os.path.basename(image_path)}")
+            return False
+        
+        print(f"✅ Successfully extracted data from {os.path.basename(image_path)}")
+        print(f"   Saved to: {json_filename}")
+        if not quiet:
+            print(payload.decode())
+        return True
+    
+    print(f"❌ Failed to extract data from {os.path.basename(image_path)}")
+    return False
+
 def main():
     """Main function to run the receipt extraction."""
     
@@ -195,20 +388,26 @@ def main():
     # Process single file or all files
     import sys
     
-    if len(sys.argv) > 1:
+    args = sys.argv[1:]
+    force = "--force" in args
+    quiet = "--quiet" in args
+    args = [arg for arg in args if arg not in ("--force", "--quiet")]
+    
+    if args:
         # Process specific file
-        image_path = sys.argv[1]
+        image_path = args[0]
         if os.path.exists(image_path):
             print(f"Processing single file: {image_path}")
-            result = extract_receipt_data(image_path)
+            with Groq(api_key=os.environ["GROQ_API_KEY"]) as client:
+                result = extract_receipt_data(client, image_path)
             if result:
-                print("\nExtracted data:")
-                print(json.dumps(result, indent=2))
-                
                 # Save to JSON file with same base name
                 json_filename = get_json_filename(image_path)
-                with open(json_filename, 'w', encoding='utf-8') as f:
-                    json.dump(result, f, indent=2, ensure_ascii=False)
+                payload = save_json(json_filename, result)
+                
+                if not quiet:
+                    print("\nExtracted data:")
+                    print(payload.decode())
                 print(f"\n✅ Result saved to {json_filename}")
             else:
                 print("Failed to extract data")
@@ -216,7 +415,7 @@ def main():
             print(f"File not found: {image_path}")
     else:
         # Process all images in current directory
-        process_all_receipts()
+        process_all_receipts(force=force, quiet=quiet)
 
 if __name__ == "__main__":
     main()